@@ -2,10 +2,48 @@ __version__ = "0.4.0"
 
 import os
 import re
+import sys
 import stat
 import shutil
 import logging
+import functools
+import itertools
+import subprocess
 from pathlib import Path
+from typing import Callable
+from operator import itemgetter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_HAS_FWALK = hasattr(os, 'fwalk')
+_PREFETCH = 8
+
+@functools.lru_cache(maxsize=128)
+def _compile(pattern: str, ascii_only: bool = False) -> re.Pattern:
+    """Compile pattern, with re.ASCII if ascii_only is set and the flag is known to be safe"""
+    # Unicode \s also matches \x1c-\x1f, so re.ASCII would change its result
+    if ascii_only and pattern.isascii() and not re.search(r'\\[uUNsS]', pattern):
+        try:
+            return re.compile(pattern, re.ASCII)
+        except (re.error, ValueError):
+            pass
+    return re.compile(pattern)
+
+@functools.lru_cache(maxsize=128)
+def _compile_matcher(pattern: str, ascii_only: bool = False) -> Callable[[str], object]:
+    """Return a search function for pattern, bypassing re for trivial ones"""
+    search = _compile(pattern, ascii_only).search
+    if pattern == '.*':
+        return lambda s: True
+    if pattern == '.+':
+        return bool
+    if re.fullmatch(r'\^[\w\-]+', pattern):
+        prefix = pattern[1:]
+        return lambda s: s.startswith(prefix)
+    if m := re.fullmatch(r'\^\.\{(\d+),(\d+)\}\$', pattern):
+        lo, hi = int(m[1]), int(m[2])
+        return lambda s: lo <= len(s) <= hi
+    return search
 
 class JenkinsClean:
 
@@ -37,6 +75,10 @@ class JenkinsClean:
         self.target_size = None
         self.preserve_pattern = None
         self.clean_pattern = None
+        self.__preserve_match = None
+        self.__clean_match = None
+        self.__du_available = sys.platform != 'win32' and shutil.which('du') is not None
+        self.__rm_available = sys.platform != 'win32' and shutil.which('rm') is not None
         logging.basicConfig(format='%(message)s', level=logging.INFO)
         self.logger = logging.getLogger(__name__)
         if quiet:
@@ -45,8 +87,8 @@ class JenkinsClean:
 
     def clean(self) -> None:
         self.__validate_args()
-        to_clean = []
         to_preserve = []
+        to_preserve_set = set()
         quota_number = self.max_workspace or None
         quota_size = None
         if self.max_size and self.max_size < shutil.disk_usage(self.path).used:
@@ -65,48 +107,84 @@ class JenkinsClean:
             self.logger.info("Actual size limit:      %s", self.proper_size(self.max_size))
         if quota_size:
             self.logger.info("Actual size target:     %s", self.proper_size(quota_size))
-        root, dirs, _ = next(self.path.walk())
+        root_str = os.path.join(self.path, '')
+        if quota_number is None and quota_size is None:
+            with os.scandir(self.path) as it:
+                dirs = [e.name for e in it if e.is_dir(follow_symlinks=False)]
+            clean_match, preserve_match = self.__matchers(dirs)
+            to_clean = []
+            for ws in dirs:
+                if clean_match and clean_match(ws) and not (preserve_match and preserve_match(ws)):
+                    to_clean.append(ws)
+                else:
+                    to_preserve.append(ws)
+            self.__apply(root_str, to_clean, to_preserve)
+            return
+        with os.scandir(self.path) as it:
+            entries = [(e.name, e.stat(follow_symlinks=False).st_mtime_ns) for e in it if e.is_dir(follow_symlinks=False)]
         self.logger.info("Sorting")
-        dirs_sorted = sorted(dirs, key=lambda x: os.path.getmtime(root / x), reverse=True)
+        entries.sort(key=itemgetter(1), reverse=True)
         self.logger.info("Scanning")
-        if self.clean_pattern:
-            to_clean += [x for x in dirs if self.clean_pattern.search(x)]
-        if self.preserve_pattern:
-            if quota_size is not None:
-                self.logger.info("Calculating always preserved workspace size")
-            for ws in dirs:
-                if self.preserve_pattern.search(ws):
+        clean_match, preserve_match = self.__matchers([ws for ws, _ in entries])
+        size = self.size
+        cap = max(int(quota_size), 0) if quota_size is not None else None
+        candidates = []
+        preserved_sizes = []
+        upcoming = iter(candidates)
+        pending = deque()
+        pool = ThreadPoolExecutor(max_workers=_PREFETCH) if quota_size is not None else None
+        try:
+            for ws, _ in entries:
+                if preserve_match and preserve_match(ws):
                     to_preserve.append(ws)
-                    if ws in to_clean:
-                        to_clean.remove(ws)
+                    to_preserve_set.add(ws)
                     if quota_number is not None:
                         quota_number -= 1
                     if quota_size is not None:
-                        quota_size -= self.size(root / ws)
-        if quota_size is not None:
-            self.logger.info("Calculating workspace size")
-        for ws in dirs_sorted:
-            if ws in to_clean or ws in to_preserve:
-                continue
-            if quota_number is not None:
-                quota_number -= 1
-                if quota_number < 0:
-                    self.logger.info("Workspace number limit reached")
-                    break
+                        preserved_sizes.append(pool.submit(size, root_str + ws, cap))
+                elif not (clean_match and clean_match(ws)):
+                    candidates.append(ws)
             if quota_size is not None:
-                quota_size -= self.size(root / ws)
-                if quota_size < 0:
-                    self.logger.info("Workspace size limit reached")
-                    break
-            to_preserve.append(ws)
+                for ws in itertools.islice(upcoming, _PREFETCH):
+                    pending.append(pool.submit(size, root_str + ws, cap))
+                if preserve_match:
+                    self.logger.info("Calculating always preserved workspace size")
+                    for future in preserved_sizes:
+                        quota_size -= future.result()
+                self.logger.info("Calculating workspace size")
+            for ws in candidates:
+                if quota_number is not None:
+                    quota_number -= 1
+                    if quota_number < 0:
+                        self.logger.info("Workspace number limit reached")
+                        break
+                if quota_size is not None:
+                    quota_size -= pending.popleft().result()
+                    if (ws_next := next(upcoming, None)) is not None:
+                        pending.append(pool.submit(size, root_str + ws_next, cap))
+                    if quota_size < 0:
+                        self.logger.info("Workspace size limit reached")
+                        break
+                to_preserve.append(ws)
+                to_preserve_set.add(ws)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
 
-        to_clean = [x for x in dirs_sorted if x not in to_preserve]
+        to_clean = [ws for ws, _ in entries if ws not in to_preserve_set]
+        self.__apply(root_str, to_clean, to_preserve)
 
+    def __apply(self, root_str: str, to_clean: list, to_preserve: list) -> None:
         self.report(to_clean, "clean")
         self.report(to_preserve, "preserve")
 
-        for ws in to_clean:
-            self.rmtree(root / ws)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(self.rmtree, [root_str + ws for ws in to_clean]))
+
+    @functools.cached_property
+    def total_bytes(self) -> int:
+        """Return the total size of the disk holding the workspaces in byte"""
+        return shutil.disk_usage(self.path).total
 
     def proper_size(self, size: float) -> str:
         """Return a human readable size"""
@@ -124,17 +202,68 @@ class JenkinsClean:
         else:
             self.logger.info("No workspace to %s", to)
 
-    def size(self, path: Path) -> float:
-        """Return the size of a directory in byte"""
-        ret = 0.0
-        for root, _, files in path.walk():
-            ret += sum((root / f).stat().st_size for f in files)
+    def size(self, path: str | Path, cap: int | None = None) -> int:
+        """Return the disk space used by a directory in byte, or any total above cap"""
+        if self.__du_available:
+            try:
+                ret = self.__du_size(path)
+            except OSError:
+                self.__du_available = False
+            else:
+                if ret is not None:
+                    return ret
+        if _HAS_FWALK:
+            return self.__fwalk_size(path, cap)
+        # Windows only: neither du nor st_blocks, so count apparent sizes
+        ret = 0
+        stack = [os.fspath(path)]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    ret += entry.stat(follow_symlinks=False).st_size
+                    if cap is not None and ret > cap:
+                        return ret
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
         return ret
 
+    def __fwalk_size(self, path: str | Path, cap: int | None) -> int:
+        # Count like du: include the root itself and hard-linked files once
+        try:
+            ret = os.stat(path, follow_symlinks=False).st_blocks * 512
+        except OSError:
+            return 0
+        seen = set()
+        for _, dirs, files, rootfd in os.fwalk(path):
+            for name in itertools.chain(dirs, files):
+                st = os.stat(name, dir_fd=rootfd, follow_symlinks=False)
+                if st.st_nlink > 1 and not stat.S_ISDIR(st.st_mode):
+                    if (st.st_dev, st.st_ino) in seen:
+                        continue
+                    seen.add((st.st_dev, st.st_ino))
+                ret += st.st_blocks * 512
+                if cap is not None and ret > cap:
+                    return ret
+        return ret
+
+    def __du_size(self, path: str | Path) -> int | None:
+        # du exits non-zero on unreadable entries but still prints the total
+        result = subprocess.run(['du', '-sk', '--', str(path)], capture_output=True)
+        try:
+            return int(result.stdout.split(maxsplit=1)[0]) * 1024
+        except (IndexError, ValueError):
+            return None
+
     def rmtree(self, path: str | Path) -> None:
         if self.dry_run or not self.force:
             return
         self.logger.info("Removing %s", str(path))
+        if self.__rm_available and subprocess.run(['rm', '-rf', '--', str(path)], stderr=subprocess.DEVNULL).returncode == 0:
+            return
         shutil.rmtree(path, onexc=self.__onexc)
 
     def __onexc(self, func, path, excinfo):
@@ -144,6 +273,17 @@ class JenkinsClean:
         else:
             self.logger.warning("warning: failed to remove %s: %s", path, excinfo)
 
+    def __matchers(self, names: list) -> tuple:
+        """Return the clean and preserve matchers, ASCII-only if all names are ASCII"""
+        if not all(map(str.isascii, names)):
+            return self.__clean_match, self.__preserve_match
+        clean_match = preserve_match = None
+        if self.always_clean_pattern:
+            clean_match = _compile_matcher(self.always_clean_pattern, True)
+        if self.always_preserve_pattern:
+            preserve_match = _compile_matcher(self.always_preserve_pattern, True)
+        return clean_match, preserve_match
+
     def __validate_args(self) -> None:
         if not self.dry_run and not self.force:
             raise JenkinsCleanError("neither -f nor -n given, refusing to clean")
@@ -164,25 +304,27 @@ class JenkinsClean:
             raise JenkinsCleanError(f"invalid target_percentage: {self.target_percentage}")
 
         if self.max_gb and self.max_percentage:
-            self.max_size = min(self.max_gb * 2**30, shutil.disk_usage(self.path).total * self.max_percentage // 100)
+            self.max_size = min(self.max_gb * 2**30, self.total_bytes * self.max_percentage // 100)
         elif self.max_gb:
             self.max_size = self.max_gb * 2**30
         elif self.max_percentage:
-            self.max_size = shutil.disk_usage(self.path).total * self.max_percentage // 100
+            self.max_size = self.total_bytes * self.max_percentage // 100
         elif self.max_workspace is None:
             self.logger.warning("warning: no limit specified, will not clean")
 
         if self.target_gb and self.target_percentage:
-            self.target_size = min(self.target_gb * 2**30, shutil.disk_usage(self.path).total * self.target_percentage // 100)
+            self.target_size = min(self.target_gb * 2**30, self.total_bytes * self.target_percentage // 100)
         elif self.target_gb:
             self.target_size = self.target_gb * 2**30
         elif self.target_percentage:
-            self.target_size = shutil.disk_usage(self.path).total * self.target_percentage // 100
+            self.target_size = self.total_bytes * self.target_percentage // 100
 
         if self.always_clean_pattern:
-            self.clean_pattern = re.compile(self.always_clean_pattern)
+            self.clean_pattern = _compile(self.always_clean_pattern)
+            self.__clean_match = _compile_matcher(self.always_clean_pattern)
         if self.always_preserve_pattern:
-            self.preserve_pattern = re.compile(self.always_preserve_pattern)
+            self.preserve_pattern = _compile(self.always_preserve_pattern)
+            self.__preserve_match = _compile_matcher(self.always_preserve_pattern)
 
     def __process_path(self) -> None:
         if not self.path:
@@ -3,27 +3,33 @@
 import sys
 import shutil
 import argparse
+import functools
 from pathlib import Path
 from string import Template
 
 from jenkinsclean import JenkinsClean, JenkinsCleanError, __version__
 
 DEFAULT_FORMAT_STRING = r"Usage of $path: $used GiB / $total GiB (${percentage}%), $free GiB free"
+_DEFAULT_TEMPLATE = Template(DEFAULT_FORMAT_STRING)
+
+@functools.lru_cache(maxsize=32)
+def _template(format_str: str) -> Template:
+    return Template(format_str)
 
 def path_usage(path: Path | None = None, format_str: str | None = None) -> str:
     """
     Available format tokens are $path, $total, $used, $free, and $percentage.  Space is in GiB.
     """
     path = path or Path.cwd()
-    format_str = format_str or DEFAULT_FORMAT_STRING
+    template = _template(format_str) if format_str else _DEFAULT_TEMPLATE
     mapping = {}
     usage = shutil.disk_usage(path)
     mapping['path'] = path
-    mapping['total'] = usage.total // 2**30
-    mapping['used'] = usage.used // 2**30
-    mapping['free'] = usage.free // 2**30
+    mapping['total'] = usage.total >> 30
+    mapping['used'] = usage.used >> 30
+    mapping['free'] = usage.free >> 30
     mapping['percentage'] = 100 * usage.used // usage.total
-    return Template(format_str).safe_substitute(mapping)
+    return template.safe_substitute(mapping)
 
 def parse_args():
     parser = argparse.ArgumentParser(